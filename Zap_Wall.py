@@ -8,16 +8,18 @@ See every zap in your terminal *and* on a fullscreen scrolling comment wall!
 - All logic for Nostr zap, lnaddress, comment.
 """
 
-import json, sys, threading, time, uuid, traceback
-from datetime import datetime
+import itertools, queue, re, sys, threading, time, traceback
+from collections import OrderedDict, deque
+from functools import partial
 from pathlib import Path
 
+import orjson
 import websocket
 from bolt11 import decode as decode_bolt11
 from colorama import Fore, Style, init as color_init
 
 from PyQt5.QtWidgets import QApplication, QLabel, QVBoxLayout, QWidget
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, pyqtSignal, pyqtSlot
 from PyQt5.QtGui import QFont
 from PyQt5.QtGui import QCursor
 
@@ -27,6 +29,7 @@ TOTAL_SAT = 0
 LNBITS_WS = "xxx"
 #For example LNBITS_WS = "wss://NODE_URL/api/v1/ws/INVOICE_READ_KEY"
 #Please input NODE_URL without https:// 
+LNBITS_RECONNECT = 5       # seconds to wait before redialling a dropped LNbits socket
 
 RELAYS = [
     "wss://relay.damus.io",
@@ -34,29 +37,50 @@ RELAYS = [
     "wss://relay.nostr.band",
 ]
 PROFILE_TIMEOUT = 4
+PROFILE_CACHE_TTL = 3600   # seconds a looked-up name stays valid
+PROFILE_CACHE_SIZE = 1024
+RELAY_PING_INTERVAL = 30   # ping a relay socket after this many idle seconds
+RELAY_MAX_BACKOFF = 60
 VERBOSE_LNBITS_RAW = True
 VERBOSE_RELAY = True
-LOG_FILE = None
+LOG_FILE = None            # e.g. "zapwall.log" – appended to, without colours
 MAX_COMMENTS = 6
 # ---------------------------------------------------------------
 color_init()
 
+_loads = orjson.loads
+
 # ---------- Logging (Console/Terminal) ----------
+_ANSI = re.compile(r"\x1b\[[0-9;]*m")
+_log_fp = None  # opened in main() when LOG_FILE is set
+
 def log(msg: str, colour=Fore.GREEN):
-    ts = datetime.now().strftime("%H:%M:%S")
+    ts = time.strftime("%H:%M:%S", time.localtime())
     out = f"{Fore.CYAN}{ts}{Style.RESET_ALL} {colour}{msg}{Style.RESET_ALL}"
     print(out, flush=True)
-    if LOG_FILE:
-        LOG_FILE.write_text(out + "\n", append=True)
+    if _log_fp:
+        _log_fp.write(_ANSI.sub("", out) + "\n")
 
-def debug(msg: str):
-    log(f"[DEBUG] {msg}", Fore.YELLOW)
+def preview(frame, n: int) -> str:
+    """First n bytes of a raw websocket frame, printable for debug output."""
+    head = frame[:n]
+    return head.decode("utf-8", "replace") if isinstance(head, bytes) else head
+
+if VERBOSE_LNBITS_RAW or VERBOSE_RELAY:
+    def debug(msg: str):
+        log(f"[DEBUG] {msg}", Fore.YELLOW)
+else:
+    def debug(msg: str):
+        pass  # all debug output is switched off in CONFIG
 
 # ----------- PyQt5 Big Wall GUI -------------
 class ZapWall(QWidget):
+    zap_received = pyqtSignal(str, 'qlonglong')  # (message, sats) – safe to emit from any thread
+
     def __init__(self):
         super().__init__()
-        self.comments = []
+        self.zap_received.connect(self.add_comment, Qt.QueuedConnection)
+        self.comments = deque(maxlen=MAX_COMMENTS)  # oldest drops off automatically
         self.total_sats = 0
         self.init_ui()
 
@@ -68,17 +92,20 @@ class ZapWall(QWidget):
 
         # Add main comment labels
         self.labels = []
+        self._prev_texts = [''] * MAX_COMMENTS  # what each label currently shows
         for _ in range(MAX_COMMENTS):
             label = QLabel('')
             label.setAlignment(Qt.AlignCenter)
             label.setFont(QFont('Arial', 16, QFont.Bold))
             label.setWordWrap(True)                 # <-- Add this!
-            label.setMaximumWidth(self.width())     # <-- Set maximum width
+            label.setTextFormat(Qt.PlainText)       # zap text is never HTML
             self.layout.addWidget(label)
             self.labels.append(label)
 
         # ----- ADD THIS LABEL LAST -----
-        self.total_label = QLabel(f"จำนวน Sat สะสม : {self.total_sats}", self)
+        self._total_prefix = "จำนวน Sat สะสม : "
+        self.total_label = QLabel(self._total_prefix + format(self.total_sats, ","), self)
+        self.total_label.setTextFormat(Qt.PlainText)
         self.total_label.setAlignment(Qt.AlignRight | Qt.AlignBottom)
         self.total_label.setFont(QFont('Arial', 20, QFont.Bold))
         self.total_label.setStyleSheet("color: #ffeb3b; margin-right: 30px; margin-bottom: 10px;")
@@ -92,78 +119,245 @@ class ZapWall(QWidget):
         self.resize(730, 590) # <-- Window size
         self.show()
 
+    @pyqtSlot(str, 'qlonglong')  # 64-bit: big zaps must not wrap a C++ int
     def add_comment(self, msg, sats=None):
-        if len(self.comments) >= MAX_COMMENTS:
-            self.comments.pop(0)
         self.comments.append(msg)
+        # Hold repaints until every label is set, and only touch labels that changed
+        self.setUpdatesEnabled(False)
         for i, label in enumerate(self.labels):
-            if i < len(self.comments):
-                label.setText(self.comments[i])
-            else:
-                label.setText('')
+            text = self.comments[i] if i < len(self.comments) else ''
+            if text != self._prev_texts[i]:
+                label.setText(text)
+                self._prev_texts[i] = text
         # Update total sats
         if sats is not None:
             self.total_sats += sats
-            self.total_label.setText(f"จำนวน Sat สะสม : {self.total_sats:,}")
+            self.total_label.setText(self._total_prefix + format(self.total_sats, ","))
+        self.setUpdatesEnabled(True)  # schedules a single repaint
+
+    def resizeEvent(self, event):
+        # Follow the real window width (resize, fullscreen) without setting a minimum
+        super().resizeEvent(event)
+        for label in self.labels:
+            label.setMaximumWidth(event.size().width() - 40)
 
     def keyPressEvent(self, event):
         if event.key() == Qt.Key_Escape:
             self.close()
 
+# ----------- Nostr Relay Pool -----------
+class RelayPool:
+    """Long-lived relay websockets shared by every profile lookup.
+
+    One reader thread per relay feeds frames into per-subscription queues,
+    pings idle sockets and reconnects with exponential backoff.
+    """
+    def __init__(self, relays):
+        self.relays = relays
+        self.sockets = {}   # relay url -> websocket.WebSocket
+        self.subs = {}      # sub_id -> queue.Queue of (relay, msg)
+        self.lock = threading.Lock()
+
+    def start(self):
+        for relay in self.relays:
+            threading.Thread(target=self._run, args=(relay,), daemon=True).start()
+
+    def healthy(self):
+        with self.lock:
+            return list(self.sockets.items())
+
+    def subscribe(self, sub_id):
+        replies = queue.Queue()
+        self.subs[sub_id] = replies
+        return replies
+
+    def unsubscribe(self, sub_id):
+        self.subs.pop(sub_id, None)
+
+    def _run(self, relay):
+        backoff = 1
+        while True:
+            ws = None
+            try:
+                if VERBOSE_RELAY:
+                    debug(f"Connecting to relay {relay} …")
+                ws = websocket.create_connection(relay, timeout=PROFILE_TIMEOUT,
+                                                 skip_utf8_validation=True)
+                ws.settimeout(RELAY_PING_INTERVAL)
+                with self.lock:
+                    self.sockets[relay] = ws
+                if VERBOSE_RELAY:
+                    debug(f"Relay {relay} connected ✓")
+                backoff = 1
+                awaiting_pong = False
+                while True:
+                    try:
+                        opcode, data = ws.recv_data(control_frame=True)
+                    except websocket.WebSocketTimeoutException:
+                        if awaiting_pong:
+                            raise ConnectionError("no pong, connection is dead")
+                        ws.ping()
+                        awaiting_pong = True
+                        continue
+                    awaiting_pong = False
+                    if opcode == websocket.ABNF.OPCODE_CLOSE:
+                        raise ConnectionError("closed by relay")
+                    if opcode == websocket.ABNF.OPCODE_TEXT:
+                        self._dispatch(relay, data)  # raw bytes, orjson parses them as-is
+            except Exception as e:
+                debug(f"Relay {relay} error: {e} – reconnecting in {backoff}s")
+            with self.lock:
+                self.sockets.pop(relay, None)
+            if ws is not None:
+                try:
+                    ws.close()
+                except Exception:
+                    pass
+            time.sleep(backoff)
+            backoff = min(backoff * 2, RELAY_MAX_BACKOFF)
+
+    def _dispatch(self, relay, frame):
+        if VERBOSE_RELAY:
+            debug(f"← RECV   {preview(frame, 120)}…")
+        try:
+            msg = _loads(frame)
+            replies = self.subs.get(msg[1])
+        except Exception as e:
+            debug(f"Relay {relay} sent unusable frame: {e}")
+            return
+        if replies is not None:
+            replies.put((relay, msg))
+
+relay_pool = RelayPool(RELAYS)
+
 # ----------- Nostr Profile Lookup -----------
+_profile_cache = OrderedDict()  # pubkey -> (monotonic timestamp, name)
+_sub_counter = itertools.count()  # sub_ids only need to be unique on our own sockets
+
 def fetch_profile_name(pubkey: str) -> str:
-    """Fetch display_name / name / fallback pubkey from the first relay that answers."""
-    sub_id = uuid.uuid4().hex[:8]
+    """Fetch display_name / name / fallback pubkey, querying all relays in parallel."""
+    cached = _profile_cache.get(pubkey)
+    if cached is not None and time.monotonic() - cached[0] < PROFILE_CACHE_TTL:
+        _profile_cache.move_to_end(pubkey)
+        if VERBOSE_RELAY:
+            debug(f"Profile cache hit: {cached[1]}")
+        return cached[1]
+    sub_id = format(next(_sub_counter), "x")
     filt = {"authors": [pubkey], "kinds": [0], "limit": 1}
-    for relay in RELAYS:
-        try:
-            debug(f"Connecting to relay {relay} …")
-            ws = websocket.create_connection(relay, timeout=PROFILE_TIMEOUT)
-            if VERBOSE_RELAY:
-                debug(f"→ SEND   ['REQ', '{sub_id}', {filt}]")
-            ws.send(json.dumps(["REQ", sub_id, filt]))
-            ws.settimeout(PROFILE_TIMEOUT)
-            while True:
-                frame = ws.recv()
+    replies = relay_pool.subscribe(sub_id)
+    req = orjson.dumps(["REQ", sub_id, filt]).decode()
+    sent = {}  # relay url -> websocket the REQ went out on
+    try:
+        # Ask every relay at once; the first one with a name wins
+        for relay, ws in relay_pool.healthy():
+            try:
                 if VERBOSE_RELAY:
-                    debug(f"← RECV   {frame[:120]}…")
-                msg = json.loads(frame)
-                if msg[0] == "EVENT" and msg[1] == sub_id:
-                    meta = json.loads(msg[2]["content"])
+                    debug(f"→ SEND   ['REQ', '{sub_id}', {filt}] to {relay}")
+                ws.send(req)
+                sent[relay] = ws
+            except Exception as e:
+                debug(f"Relay {relay} error: {e}")
+        pending = set(sent)  # relays that have not reached EOSE yet
+        deadline = time.monotonic() + PROFILE_TIMEOUT
+        while pending:
+            try:
+                relay, msg = replies.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                debug(f"Timed out waiting for {', '.join(pending)}")
+                break
+            if msg[0] == "EVENT":
+                try:
+                    meta = _loads(msg[2]["content"])
                     name = (
                         meta.get("display_name")
                         or meta.get("name")
                         or meta.get("username")
                     )
-                    ws.close()
-                    if name:
+                except Exception as e:
+                    debug(f"Relay {relay} sent bad profile: {e}")
+                    continue
+                if name:
+                    name = sys.intern(str(name))  # repeat zappers share one string
+                    if VERBOSE_RELAY:
                         debug(f"Profile found: {name}")
-                        return name
-                    break
-                if msg[0] == "EOSE":
-                    debug("Reached EOSE – no profile on this relay")
-                    break
-            ws.close()
-        except Exception as e:
-            debug(f"Relay {relay} error: {e}")
+                    _profile_cache[pubkey] = (time.monotonic(), name)
+                    _profile_cache.move_to_end(pubkey)
+                    if len(_profile_cache) > PROFILE_CACHE_SIZE:
+                        _profile_cache.popitem(last=False)
+                    return name
+            elif msg[0] == "EOSE":
+                if VERBOSE_RELAY:
+                    debug(f"Reached EOSE – no profile on {relay}")
+                pending.discard(relay)
+            elif msg[0] == "CLOSED":
+                reason = msg[2] if len(msg) > 2 else ""
+                debug(f"Relay {relay} closed the subscription: {reason}")
+                pending.discard(relay)
+    finally:
+        relay_pool.unsubscribe(sub_id)
+        close = orjson.dumps(["CLOSE", sub_id]).decode()
+        for ws in sent.values():
+            try:
+                ws.send(close)
+            except Exception:
+                pass
     return pubkey[:12] + "…"  # fallback
 
+# ----------- Bolt11 Amount -----------
+_BOLT11_HRP = re.compile(r"ln[a-z]+?(\d+)([munp]?)")
+_MSAT_PER_UNIT = {"": 100_000_000_000, "m": 100_000_000, "u": 100_000, "n": 100}
+
+def bolt11_amount_msat(bolt11: str) -> int:
+    """Read the amount from the invoice's human-readable part, skipping the full decode."""
+    hrp = bolt11.lower().rpartition("1")[0]
+    m = _BOLT11_HRP.fullmatch(hrp)
+    if not m:
+        raise ValueError(f"no amount in bolt11 prefix {hrp!r}")
+    amount, unit = int(m.group(1)), m.group(2)
+    if unit == "p":
+        if amount % 10:
+            raise ValueError("bolt11 amount is not a whole millisatoshi")
+        return amount // 10
+    return amount * _MSAT_PER_UNIT[unit]
+
 # ----------- Main LNbits/Wall Handler -----------
+SEEN_INVOICES_MAX = 256
+_seen_invoices = OrderedDict()  # bounded, insertion-ordered set of shown payment hashes
+zap_queue = queue.Queue()       # (sats, zap_content, pubkey) waiting for a profile name
+
+def remember_invoice(payment_hash):
+    _seen_invoices[payment_hash] = None
+    if len(_seen_invoices) > SEEN_INVOICES_MAX:
+        _seen_invoices.popitem(last=False)
+
 def handle_zap(sats, zap_content, name, gui=None):
     global TOTAL_SAT
     msg = f"⚡ {sats} sats from {name}\n{zap_content}"
     TOTAL_SAT += sats
     log(msg, Fore.MAGENTA)
     if gui:
-        #gui.add_comment(msg)
-        gui.add_comment(msg, sats=sats)  # Pass sats to update total
+        gui.zap_received.emit(msg, sats)  # add_comment runs on the GUI thread
 
-def on_message_handler(gui, raw: str):
+def zap_worker(gui=None):
+    """Resolve profile names off the LNbits socket thread and show the zaps in order."""
+    while True:
+        sats, zap_content, pubkey = zap_queue.get()
+        try:
+            name = fetch_profile_name(pubkey) if pubkey else "someone"
+            handle_zap(sats, zap_content, name, gui=gui)
+        except Exception as e:
+            debug(f"Zap worker error: {e}\n{traceback.format_exc(limit=2)}")
+
+def on_message_handler(gui, raw: bytes):
     if VERBOSE_LNBITS_RAW:
-        debug(f"Raw LNbits msg: {raw[:300]}…")
+        debug(f"Raw LNbits msg: {preview(raw, 300)}…")
+    # Keepalives and status frames never mention a payment – drop them unparsed
+    if b"payment_hash" not in raw:
+        debug("Message has no payment_hash → skipping")
+        return
     try:
-        data = json.loads(raw)
-    except json.JSONDecodeError as e:
+        data = _loads(raw)
+    except orjson.JSONDecodeError as e:
         debug(f"JSON error: {e}")
         return
 
@@ -176,28 +370,40 @@ def on_message_handler(gui, raw: str):
         debug("Message has no usable payment_hash → skipping")
         return
 
-    if not invoice.get("paid", False) and not invoice.get("status") == "success":
+    paid = invoice.get("paid") or invoice.get("status") == "success"
+    if not paid:
         debug("Invoice not marked as paid → skipping")
         return
 
+    # LNbits retransmits on reconnect – show each payment only once
+    payment_hash = invoice["payment_hash"]
+    if payment_hash in _seen_invoices:
+        debug(f"Invoice {payment_hash[:12]}… already shown → skipping")
+        return
+
+    bolt = None
     try:
-        bolt = decode_bolt11(invoice["bolt11"])
-        sats = bolt.amount_msat // 1000
-        debug(f"Invoice decoded: {sats} sats")
+        sats = bolt11_amount_msat(invoice["bolt11"]) // 1000
     except Exception as e:
-        debug(f"bolt11 decode failed: {e}\n{traceback.format_exc(limit=2)}")
-        return
+        debug(f"bolt11 fast amount failed ({e}) → full decode")
+        try:
+            bolt = decode_bolt11(invoice["bolt11"])
+            sats = bolt.amount_msat // 1000
+        except Exception as e:
+            debug(f"bolt11 decode failed: {e}\n{traceback.format_exc(limit=2)}")
+            return
+    debug(f"Invoice decoded: {sats} sats")
 
     pubkey = None
     zap_content = None
     is_nostr_zap = False
-    name = "someone"
+    extra = invoice.get("extra") or {}
 
     # Detect Nostr zap
-    if "extra" in invoice and "nostr" in invoice["extra"]:
+    nostr_json = extra.get("nostr")
+    if nostr_json:
         try:
-            nostr_json = invoice["extra"]["nostr"]
-            zap_req = json.loads(nostr_json)
+            zap_req = _loads(nostr_json)
             pubkey = zap_req.get("pubkey")
             zap_content = zap_req.get("content", "")
             debug(f"Zap‑request pubkey found: {pubkey}, content: {zap_content}")
@@ -205,47 +411,74 @@ def on_message_handler(gui, raw: str):
         except Exception as e:
             debug(f"Zap‑request decode error: {e}")
 
-    if is_nostr_zap and pubkey:
-        name = fetch_profile_name(pubkey)
-    else:
+    if not (is_nostr_zap and pubkey):
+        pubkey = None
         # Not a nostr zap, try LN address
         zap_content = ""
-        if "extra" in invoice and "comment" in invoice["extra"]:
-            cmt = invoice["extra"]["comment"]
-            if isinstance(cmt, list) and cmt:
-                zap_content = cmt[0]
-            elif isinstance(cmt, str):
-                zap_content = cmt
+        cmt = extra.get("comment")
+        if isinstance(cmt, list) and cmt:
+            zap_content = cmt[0]
+        elif isinstance(cmt, str):
+            zap_content = cmt
+        if not zap_content:
+            zap_content = invoice.get("memo", "") or invoice.get("comment", "")
         if not zap_content:
-            zap_content = invoice.get("memo", "") or invoice.get("comment", "") or bolt.description or ""
-        name = "someone"
+            # Only pay for a full decode when LNbits sent no memo
+            try:
+                bolt = bolt or decode_bolt11(invoice["bolt11"])
+                zap_content = bolt.description or ""
+            except Exception as e:
+                debug(f"bolt11 decode failed: {e}")
+                zap_content = ""
 
     # Fallback for zap_content if Nostr zap
     if is_nostr_zap and not zap_content:
         zap_content = "⚡️"
 
-    handle_zap(sats, zap_content, name, gui=gui)
+    remember_invoice(payment_hash)
+    zap_queue.put((sats, zap_content, pubkey))
 
 # ----------- WebSocket Logic -----------
-def on_ws_message(ws, msg):
-    on_message_handler(ws.gui, msg)
+def on_ws_open(ws):
+    debug("LNbits WebSocket connection opened ✓")
+
+def on_ws_message(gui, ws, msg):
+    on_message_handler(gui, msg)
+
+def on_ws_error(ws, err):
+    debug(f"LNbits WebSocket error: {err}")
+
+def on_ws_close(ws, status, reason):
+    debug(f"LNbits WebSocket closed (status={status}, reason={reason})")
 
 def run_websocket(gui=None):
     ws = websocket.WebSocketApp(
         LNBITS_WS,
-        on_open=lambda ws: debug("LNbits WebSocket connection opened ✓"),
-        on_message=lambda ws, msg: on_ws_message(ws, msg),
-        on_error=lambda ws, err: debug(f"LNbits WebSocket error: {err}"),
-        on_close=lambda ws, status, reason: debug(f"LNbits WebSocket closed (status={status}, reason={reason})")
+        on_open=on_ws_open,
+        on_message=partial(on_ws_message, gui),
+        on_error=on_ws_error,
+        on_close=on_ws_close,
     )
-    ws.gui = gui
-    ws.run_forever(ping_interval=20, ping_timeout=8)
+    # Redial here rather than with run_forever(reconnect=…): websocket-client skips
+    # on_error/on_close for drops once it is reconnecting, so outages went unlogged.
+    # Each pass below reports the drop via on_error/on_close and the redial via on_open.
+    while True:
+        # skip_utf8_validation: frames reach on_message as raw bytes, neither
+        # validated in pure Python nor decoded to str – orjson checks UTF-8 itself
+        ws.run_forever(ping_interval=20, ping_timeout=8, skip_utf8_validation=True)
+        debug(f"LNbits WebSocket down – redialling in {LNBITS_RECONNECT}s")
+        time.sleep(LNBITS_RECONNECT)
 
 # ----------- Main Entrypoint -----------
 def main():
+    global _log_fp
+    if LOG_FILE:
+        _log_fp = open(LOG_FILE, "a", buffering=1, encoding="utf-8")  # line-buffered
     # Launch GUI wall
     app = QApplication(sys.argv)
     gui = ZapWall()
+    relay_pool.start()
+    threading.Thread(target=zap_worker, args=(gui,), daemon=True).start()
     t = threading.Thread(target=run_websocket, args=(gui,), daemon=True)
     t.start()
     sys.exit(app.exec_())